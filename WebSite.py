@@ -1,12 +1,45 @@
-import urllib.request
+import functools
 import logging
+import time
 from datetime import datetime, timezone
-from urllib.error import HTTPError, URLError
+from decimal import Decimal
 from urllib.parse import urlparse
 
+import urllib3
+from urllib3.util import Retry
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Fallback connection pool used when the caller does not supply its own
+_http = urllib3.PoolManager(retries=Retry(connect=1, read=1, redirect=10))
+
+
+@functools.lru_cache(maxsize=4096)
+def _valid_url(url: str) -> bool:
+    result = urlparse(url)
+    return bool(result.scheme and result.netloc)
+
+
+def normalize(site_obj: dict):
+    """
+    Map a site record to the keys expected by WebSite.  Entries stored under a
+    '_'-prefixed key are renamed, with the plain key taking precedence, and
+    entries that are not WebSite attributes are dropped.
+
+    Parameters
+    ----------
+    site_obj: dict
+        A dictionary representing a site.
+
+    Returns
+    -------
+    dict
+        A dictionary containing only WebSite attribute names as keys.
+    """
+    return {k: site_obj.get(k, site_obj.get('_' + k)) for k in WebSite.__slots__
+            if k in site_obj or '_' + k in site_obj}
+
 
 class WebSite:
     """
@@ -21,7 +54,9 @@ class WebSite:
     ----------
     site_obj: dict
         A dictionary representing the current site.  This must contain at a minimum
-        a 'url' entry providing the URL of the site.  All other values are optional
+        a 'url' entry providing the URL of the site.  All other values are optional.
+        Keys must match the attribute names; see `normalize` for records that may
+        still use '_'-prefixed keys.
 
     Raises
     ------
@@ -29,101 +64,37 @@ class WebSite:
         If the URL is invalid.
     """
 
+    __slots__ = ('url', 'http_status', 'http_reason', 'last_checked', 'last_changed',
+                 'elapsed_time', 'is_changed', 'is_up', 'is_slow', 'next_check_at', 'stable_checks',
+                 'etag', 'last_modified')
+
     def __init__(self, site_obj: dict):
-        self._url = site_obj.get('url', site_obj.get('_url', None))
-        result = urlparse(self._url)
-        if result.scheme and result.netloc:
-            self._http_status = site_obj.get('http_status', site_obj.get('_http_status', None))
-            self._http_reason = site_obj.get('http_reason', site_obj.get('_http_reason', None))
-            self._last_checked = site_obj.get('last_checked', site_obj.get('_last_checked', None))
-            self._last_changed = site_obj.get('last_changed', site_obj.get('_last_changed', None))
-            self._elapsed_time = site_obj.get('elapsed_time', site_obj.get('_elapsed_time', None))
-            self._is_changed = False
-            self._is_up = site_obj.get('is_up', site_obj.get('_is_up', False))
-            self._is_slow = site_obj.get('is_slow', site_obj.get('_is_slow', False))
-        else:
-            raise ValueError(f'Invalid URL provided: {self._url}')
-
-    @property
-    def url(self):
-        return self._url
-
-    @property
-    def http_status(self):
-        return self._http_status
-
-    @http_status.setter
-    def http_status(self, http_status):
-        self._http_status = http_status
-
-    @property
-    def http_reason(self):
-        return self._http_reason
-
-    @http_reason.setter
-    def http_reason(self, http_reason):
-        self._http_reason = http_reason
-
-    @property
-    def last_checked(self):
-        return self._last_checked
-
-    @last_checked.setter
-    def last_checked(self, last_checked: datetime):
-        if last_checked is not None:
-            self._last_checked = last_checked.isoformat()
-        else:
-            self._last_checked = None
-
-    @property
-    def last_changed(self):
-        return self._last_changed
-
-    @last_changed.setter
-    def last_changed(self, last_changed: datetime):
-        if last_changed is not None:
-            self._last_changed = last_changed.isoformat()
-        else:
-            self._last_changed = None
-
-    @property
-    def elapsed_time(self):
-        return self._elapsed_time
-
-    @elapsed_time.setter
-    def elapsed_time(self, elapsed_time):
-        self._elapsed_time = elapsed_time
-
-    @property
-    def is_changed(self):
-        return self._is_changed
-
-    @is_changed.setter
-    def is_changed(self, is_changed):
-        self._is_changed = is_changed
-
-    @property
-    def is_up(self):
-        return self._is_up
-
-    @is_up.setter
-    def is_up(self, is_up):
-        self._is_up = is_up
-
-    @property
-    def is_slow(self):
-        return self._is_slow
-
-    @is_slow.setter
-    def is_slow(self, is_slow):
-        self._is_slow = is_slow
+        self.url = site_obj.get('url')
+        if not _valid_url(self.url):
+            raise ValueError(f'Invalid URL provided: {self.url}')
+
+        self.http_status = site_obj.get('http_status')
+        self.http_reason = site_obj.get('http_reason')
+        self.last_checked = site_obj.get('last_checked')
+        self.last_changed = site_obj.get('last_changed')
+        self.elapsed_time = site_obj.get('elapsed_time')
+        self.is_changed = False
+        self.is_up = site_obj.get('is_up', False)
+        self.is_slow = site_obj.get('is_slow', False)
+        self.next_check_at = site_obj.get('next_check_at')
+        self.stable_checks = site_obj.get('stable_checks', 0)
+        self.etag = site_obj.get('etag')
+        self.last_modified = site_obj.get('last_modified')
 
     def check_website(self, **kwargs):
         """
-        Verify that the website is reachable and performant.  The method tries
-        to open the url.  Anything other than a http status of 200 is considered
-        down.  Additionally, if the website does not respond in a prescribed amount
-        of time, it is marked as 'slow'.
+        Verify that the website is reachable and performant.  The method sends a
+        HEAD request to the url, falling back to a GET if the server does not allow
+        HEAD.  The validators from the last successful response are sent so that
+        the server may answer '304 Not Modified', which is treated as a 200.
+        Anything other than a http status of 200 is considered down.  Additionally,
+        if the website does not respond in a prescribed amount of time, it is marked
+        as 'slow'.
 
         Parameters
         ----------
@@ -132,63 +103,87 @@ class WebSite:
             number of seconds it takes for the site to be considered performant.  The
             site is considered slow if the response time exceeds this value.
             The default value is '5' seconds if this keyword is not provided.
+            The optional 'PoolManager' may be provided to specify the urllib3 pool used
+            to issue the request.  Sharing a pool across checks lets keep-alive
+            connections be reused for sites on the same host.
 
         Returns
         -------
-
+        dict
+            A dictionary representing the updated state of the website.  This object
+            is left unchanged.
         """
         slow_response_threshold = kwargs.get('SlowResponseSeconds', 5)
-        current = WebSite(self.__dict__)
+        http = kwargs.get('PoolManager', _http)
+        result = self.to_dict()
+        result['is_changed'] = False
+        headers = dict()
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
         try:
-            start_time = datetime.now()
-            u = urllib.request.urlopen(self._url)
-            response_time = datetime.now() - start_time
-            current.http_status = u.status
-            current.http_reason = u.reason if u.reason else "OK"
-            current.elapsed_time = round(response_time.total_seconds())
-            current.is_up = True
-
-            if current.elapsed_time > slow_response_threshold:
-                current.is_slow = True
+            start_time = time.monotonic()
+            u = http.request('HEAD', self.url, headers=headers, redirect=True, preload_content=False)
+            response_time = time.monotonic() - start_time
+            if u.status == 405:
+                # The server does not support HEAD, fall back to a GET without reading the body
+                u.release_conn()
+                start_time = time.monotonic()
+                u = http.request('GET', self.url, headers=headers, redirect=True, preload_content=False)
+                response_time = time.monotonic() - start_time
+                # The unread body makes the connection unusable, so close it rather than reuse it
+                u.close()
+            u.release_conn()
+
+            if u.status == 304:
+                # Unchanged since the last successful response
+                result['http_status'] = 200
+                result['http_reason'] = "OK"
+            else:
+                result['http_status'] = u.status
+                result['http_reason'] = u.reason if u.reason else "OK"
+
+            if u.status == 200:
+                result['etag'] = u.headers.get('ETag')
+                result['last_modified'] = u.headers.get('Last-Modified')
+
+            # DynamoDB does not accept floats, so keep millisecond resolution as a Decimal
+            result['elapsed_time'] = Decimal(f"{response_time:.3f}")
+
+            if u.status < 400:
+                result['is_up'] = True
+                if response_time > slow_response_threshold:
+                    result['is_slow'] = True
+                else:
+                    result['is_slow'] = False
             else:
-                current.is_slow = False
+                result['is_up'] = False
 
-        except HTTPError as he:
-            current.http_status = he.code
-            current.http_reason = he.reason
-        except URLError as ue:
-            current.http_status = "N/A"
-            current.http_reason = f"{str(ue)}"
+        except urllib3.exceptions.HTTPError as he:
+            # MaxRetryError wraps the cause with the pool and url, record only the cause
+            if isinstance(he, urllib3.exceptions.MaxRetryError) and he.reason is not None:
+                he = he.reason
+            result['http_status'] = "N/A"
+            result['http_reason'] = f"{str(he)}"
+            result['is_up'] = False
 
-        if current.http_status != self._http_status or current.is_slow != self._is_slow:
-            current.last_changed = datetime.now(timezone.utc)
-            current.is_changed = True
+        if result['http_status'] != self.http_status or result['is_slow'] != self.is_slow:
+            result['last_changed'] = datetime.now(timezone.utc).isoformat()
+            result['is_changed'] = True
 
-        current.last_checked = datetime.now(timezone.utc)
+        result['last_checked'] = datetime.now(timezone.utc).isoformat()
 
-        return current.to_dict()
+        return result
 
     def to_dict(self):
         """
-        Converts the object to a dictionary with normalized keys.  The internal keys are
-        prepended with an '_' char.  This simplifies the process of reading/writing to a
-        database by providing a dict whose keys do not have the '_' char.
+        Converts the object to a dictionary keyed by attribute name.  This simplifies
+        the process of reading/writing to a database.
 
         Returns
         -------
         dict
-            A dictionary with normalized keys.
+            A dictionary with one entry per attribute.
         """
-        new_dict = dict()
-
-        new_dict['url'] = self._url
-        new_dict['http_status'] = self._http_status
-        new_dict['http_reason'] = self._http_reason
-        new_dict['is_changed'] = self._is_changed
-        new_dict['last_checked'] = self._last_checked
-        new_dict['last_changed'] = self._last_changed
-        new_dict['elapsed_time'] = self._elapsed_time
-        new_dict['is_up'] = self._is_up
-        new_dict['is_slow'] = self._is_slow
-
-        return new_dict
+        return {k: getattr(self, k) for k in self.__slots__}
@@ -1,16 +1,155 @@
 import boto3
+import functools
 import os
-import json
 import logging
+import random
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from WebSite import WebSite
+import orjson
+import urllib3
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from urllib3.util import Retry
+from urllib3.util.connection import allowed_gai_family
+
+from WebSite import WebSite, normalize
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize the DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+# Configuration, read once per container
+_TABLE_NAME = os.environ['TABLE_NAME']
+_RESPONSE_LIMIT = int(os.environ['RESPONSE_LIMIT'])
+_CHECK_TTL = int(os.environ.get('CHECK_TTL_SECONDS', 60))
+# Adaptive check intervals are opt-in; by default every site is checked on every invocation
+_CHECK_BASE_INTERVAL = int(os.environ.get('CHECK_BASE_INTERVAL_SECONDS', 0))
+_CHECK_MAX_INTERVAL = int(os.environ.get('CHECK_MAX_INTERVAL_SECONDS', _CHECK_BASE_INTERVAL))
+_SNS_TOPIC = os.environ['SNS_TOPIC']
+_SNS_TOPIC_NAME = _SNS_TOPIC.rsplit(':', 1)[-1]
+_STATUS_URL = os.environ['STATUS_PAGE_URL']
+
+# Initialize the DynamoDB and SNS clients
+_dynamodb = boto3.resource('dynamodb')
+_sns = boto3.client('sns')
+
+# Shared connection pool, kept across invocations on a warm container so that
+# keep-alive connections are reused between checks against the same host
+http = urllib3.PoolManager(num_pools=32, maxsize=8, retries=Retry(connect=1, read=1, redirect=10),
+                           timeout=urllib3.Timeout(connect=2, read=_RESPONSE_LIMIT * 2))
+
+# Number of seconds resolved host addresses are cached for
+DNS_CACHE_TTL = 300
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_getaddrinfo(ttl_bucket, host, port, family):
+    # Keep every distinct address, in resolver order, so connections can fall back
+    addresses = (info[4][0] for info in socket.getaddrinfo(host, port, family, socket.SOCK_STREAM))
+    return tuple(dict.fromkeys(addresses))
+
+
+def resolve(host: str, port: int):
+    """
+    Resolve a host through a cache shared by the website check connections, so
+    checking sites on the same host does not repeat the DNS lookup.  Entries
+    expire when the monotonic clock moves into the next DNS_CACHE_TTL window;
+    failed lookups are not cached.
+
+    Parameters
+    ----------
+    host: str
+        The host name to resolve.
+    port: int
+        The port to connect to.
+
+    Returns
+    -------
+    tuple
+        The addresses the host resolves to, in the order returned by the resolver.
+    """
+    bucket = int(time.monotonic() // DNS_CACHE_TTL)
+    return _cached_getaddrinfo(bucket, host, port, allowed_gai_family())
+
+
+class _CachedDNSConnection:
+    """
+    Mixin for urllib3 connections that opens the socket to the cached addresses
+    of the host, trying each in turn as urllib3 does for a fresh lookup.  The
+    host name is still used for the Host header, SNI and certificate verification.
+    """
+
+    def __str__(self):
+        # Error messages end up in the status table, so name the urllib3 class rather than the mixin
+        base = next(c for c in type(self).__mro__ if c.__module__ == HTTPConnection.__module__)
+        return f"{base.__name__}(host={self.host!r}, port={self.port!r})"
+
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = resolve(host, self.port)
+        except socket.gaierror as e:
+            raise NewConnectionError(self, f"Failed to resolve '{host}' ({e})") from e
+
+        # urllib3 connects to _dns_host, which is also what the public host property
+        # returns.  Swapping it is only safe because connect() reads
+        # server_hostname = self.host (for SNI and certificate checks) after _new_conn
+        # returns, by which time the finally below has restored the host name.
+        error = None
+        try:
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except ConnectTimeoutError as e:
+                    # Also covers NewConnectionError, e.g. a refused connection
+                    error = e
+        finally:
+            self._dns_host = host
+
+        raise error
+
+
+class _CachedDNSHTTPConnection(_CachedDNSConnection, HTTPConnection):
+    pass
+
+
+class _CachedDNSHTTPSConnection(_CachedDNSConnection, HTTPSConnection):
+    pass
+
+
+class _CachedDNSHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CachedDNSHTTPConnection
+
+
+class _CachedDNSHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CachedDNSHTTPSConnection
+
+
+# Only the website check pool uses the cache; the AWS clients resolve as usual
+http.pool_classes_by_scheme = {'http': _CachedDNSHTTPConnectionPool,
+                               'https': _CachedDNSHTTPSConnectionPool}
+
+# Maximum number of websites checked concurrently
+MAX_WORKERS = 32
+
+# Worker threads for the HTTP checks, kept across invocations on a warm container
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+# DynamoDB limits on the number of keys/items per batch request
+BATCH_GET_LIMIT = 100
+BATCH_WRITE_LIMIT = 25
+
+# Number of times unprocessed batch keys/items are retried before giving up
+BATCH_MAX_RETRIES = 5
+
+# Results of recent checks, kept across invocations on a warm container.
+# Maps a URL to the monotonic time it was checked and the resulting site dict.
+_cache = dict()
+
 
 def lambda_handler(event, context):
     """
@@ -31,45 +170,276 @@ def lambda_handler(event, context):
         A json string containing the http status of the lambda call.
     """
 
-    # input from SQS queue
-    content = event['Records'][0]['body']
-    urls = json.loads(content).get('urls')
+    # input from SQS queue, merging the urls of every record in the batch.  A bad
+    # record is logged and skipped so it does not fail the rest of the batch.
+    urls = []
+    for record in event['Records']:
+        try:
+            record_urls = orjson.loads(record['body']).get('urls') or []
+            if not isinstance(record_urls, list) or not all(isinstance(url, str) for url in record_urls):
+                raise ValueError("'urls' must be a list of strings")
+            urls.extend(record_urls)
+        except Exception as e:
+            logger.error(f"Unable to read SQS message {record.get('messageId')}:{str(e)}")
+    urls = list(dict.fromkeys(urls))
 
-    tbl_name = os.environ['TABLE_NAME']
-    websites_tbl = dynamodb.Table(tbl_name)
     changed_sites = []
 
     try:
-        response_limit = os.environ['RESPONSE_LIMIT']
+        cached_urls = [url for url in urls if is_cached(url, _CHECK_TTL)]
+        if cached_urls:
+            logger.info(f"Skipping {len(cached_urls)} recently checked websites")
+        urls = [url for url in urls if url not in cached_urls]
+
+        items, unread_urls = get_items(_TABLE_NAME, urls)
+        unread_urls = set(unread_urls)
+        now = time.time()
+        web_sites = []
         for url in urls:
             try:
-                item = websites_tbl.get_item(Key={'url': url})['Item']
-                web_site = WebSite(item)
-                logger.info(f"Checking website '{web_site.url}'")
-                updated_site_dict = web_site.check_website(SlowResponseSeconds=int(response_limit))
-                updated_site = WebSite(updated_site_dict)
+                if url in unread_urls:
+                    # Already logged by get_items
+                    continue
+                if url not in items:
+                    raise KeyError(f"'{url}' not found in {_TABLE_NAME}")
+                item = items[url] = normalize(items[url])
+                next_check_at = item.get('next_check_at')
+                if next_check_at is not None and now < next_check_at:
+                    logger.info(f"Skipping website '{url}' until its next scheduled check")
+                    continue
+                web_sites.append(WebSite(item))
+            except Exception as e:
+                logger.error(f"Unable to process url {url}:{str(e)}")
 
-                if updated_site.is_changed:
-                    changed_sites.append(updated_site)
+        # The checks are I/O bound, so issue them concurrently against the shared pool.
+        # Each full batch of results is written from this thread while the remaining
+        # checks are still in flight.
+        updated_items = []
+        failed_urls = []
+        futures = {_executor.submit(check_one, web_site, _RESPONSE_LIMIT): web_site.url
+                   for web_site in web_sites}
+
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                updated_site_dict = future.result()
+                schedule_next_check(updated_site_dict)
+                _cache[url] = (time.monotonic(), updated_site_dict)
 
-                websites_tbl.put_item(Item=updated_site_dict)
+                if updated_site_dict['is_changed']:
+                    changed_sites.append(updated_site_dict)
+
+                updated_items.append(updated_site_dict)
+                if len(updated_items) == BATCH_WRITE_LIMIT:
+                    failed_urls.extend(put_items(_TABLE_NAME, updated_items))
+                    updated_items = []
             except Exception as e:
                 logger.error(f"Unable to process url {url}:{str(e)}")
 
+        failed_urls.extend(put_items(_TABLE_NAME, updated_items))
+
+        # Sites that could not be saved must be checked again on the next invocation
+        for url in failed_urls:
+            _cache.pop(url, None)
+
+        # The checks complete in any order, report the changes in the order requested
+        url_order = {url: i for i, url in enumerate(urls)}
+        changed_sites.sort(key=lambda site: url_order[site['url']])
         publish_changes(changed_sites)
     except Exception as e:
         logger.error(f"Error scanning DynamoDB: {str(e)}")
         return {
             'statusCode': 500,
-            'body': json.dumps("Error scanning DynamoDB")
+            'body': orjson.dumps("Error scanning DynamoDB").decode()
         }
 
     return {
         'statusCode': 200,
-        'body': json.dumps("Website processed")
+        'body': orjson.dumps("Website processed").decode()
     }
 
 
+def is_cached(url: str, ttl: int):
+    """
+    Determine whether a website was checked recently enough that it does not
+    need to be checked again.  Only sites that were up, performant and unchanged
+    are cached; a site that is down, slow or has just changed is always checked
+    again.
+
+    Parameters
+    ----------
+    url: str
+        The URL of the website.
+    ttl: int
+        The number of seconds a healthy result remains valid.
+
+    Returns
+    -------
+    bool
+        True if the cached result is still valid.
+    """
+    entry = _cache.get(url)
+    if entry is None:
+        return False
+
+    checked_at, site_dict = entry
+    if site_dict['is_changed'] or not site_dict['is_up'] or site_dict['is_slow']:
+        return False
+
+    return time.monotonic() - checked_at < ttl
+
+
+def schedule_next_check(site_dict: dict):
+    """
+    Set the time at which a website is next due to be checked.  A site that is
+    down, slow or has just changed stays due, so it is checked on every
+    invocation.  Otherwise the interval starts at the base interval and doubles
+    with every further consecutive stable check, up to a maximum.  With the
+    default base interval of 0 every site stays due.  A random
+    jitter of up to 25% is added to the interval so sites on shared hosts are
+    not all checked at once.
+
+    Parameters
+    ----------
+    site_dict: dict
+        The updated state of the website.  Its 'stable_checks' and 'next_check_at'
+        entries are updated in place.
+
+    Returns
+    -------
+        None
+    """
+    if site_dict['is_changed'] or not site_dict['is_up'] or site_dict['is_slow']:
+        site_dict['stable_checks'] = 0
+        site_dict['next_check_at'] = None
+        return
+
+    stable_checks = int(site_dict['stable_checks'] or 0) + 1
+    site_dict['stable_checks'] = stable_checks
+
+    # Cap the exponent; the interval is clamped to the maximum long before this
+    interval = min(_CHECK_MAX_INTERVAL, _CHECK_BASE_INTERVAL * 2 ** min(stable_checks - 1, 32))
+    if interval <= 0:
+        site_dict['next_check_at'] = None
+        return
+
+    site_dict['next_check_at'] = int(time.time() + interval + random.uniform(0, interval * 0.25))
+
+
+def get_items(tbl_name: str, urls: list):
+    """
+    Read the last known state of the websites from the table using as few
+    BatchGetItem requests as possible.  Unprocessed keys are retried with an
+    exponential backoff.
+
+    Parameters
+    ----------
+    tbl_name: str
+        The name of the websites table.
+    urls: list
+        The URLs of the websites to read.  These must not contain duplicates.
+
+    Returns
+    -------
+    tuple
+        A dictionary of the table items keyed by URL, omitting URLs not found in
+        the table, and a list of the URLs that could not be read.
+    """
+    items = dict()
+    failed_urls = []
+    for i in range(0, len(urls), BATCH_GET_LIMIT):
+        chunk = urls[i:i + BATCH_GET_LIMIT]
+        request = {tbl_name: {'Keys': [{'url': url} for url in chunk]}}
+        try:
+            for attempt in range(BATCH_MAX_RETRIES + 1):
+                response = _dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(tbl_name, []):
+                    items[item['url']] = item
+
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                if attempt < BATCH_MAX_RETRIES:
+                    time.sleep(0.05 * 2 ** attempt)
+            else:
+                for key in request[tbl_name]['Keys']:
+                    logger.error(f"Unable to read url {key['url']} from {tbl_name}: retries exhausted")
+                    failed_urls.append(key['url'])
+        except Exception as e:
+            for url in chunk:
+                if url not in items:
+                    logger.error(f"Unable to read url {url} from {tbl_name}:{str(e)}")
+                    failed_urls.append(url)
+
+    return items, failed_urls
+
+
+def put_items(tbl_name: str, items: list):
+    """
+    Write the updated state of the websites to the table using as few
+    BatchWriteItem requests as possible.  Unprocessed items are retried with an
+    exponential backoff.  A failed request is logged and does not stop the
+    remaining items from being written.
+
+    Parameters
+    ----------
+    tbl_name: str
+        The name of the websites table.
+    items: list
+        A list of website dictionary objects.
+
+    Returns
+    -------
+    list
+        The URLs of the websites that could not be written.
+    """
+    failed_urls = []
+    for i in range(0, len(items), BATCH_WRITE_LIMIT):
+        chunk = items[i:i + BATCH_WRITE_LIMIT]
+        request = {tbl_name: [{'PutRequest': {'Item': item}} for item in chunk]}
+        try:
+            for attempt in range(BATCH_MAX_RETRIES + 1):
+                response = _dynamodb.batch_write_item(RequestItems=request)
+
+                request = response.get('UnprocessedItems')
+                if not request:
+                    break
+                if attempt < BATCH_MAX_RETRIES:
+                    time.sleep(0.05 * 2 ** attempt)
+            else:
+                for put in request[tbl_name]:
+                    url = put['PutRequest']['Item']['url']
+                    logger.error(f"Unable to write url {url} to {tbl_name}: retries exhausted")
+                    failed_urls.append(url)
+        except Exception as e:
+            # Items of earlier attempts may have been written, but which ones is unknown
+            for item in chunk:
+                logger.error(f"Unable to write url {item['url']} to {tbl_name}:{str(e)}")
+                failed_urls.append(item['url'])
+
+    return failed_urls
+
+
+def check_one(web_site: WebSite, response_limit: int):
+    """
+    Check a single website using the shared connection pool.
+
+    Parameters
+    ----------
+    web_site: WebSite
+        The last known state of the website.
+    response_limit: int
+        The number of seconds after which the site is considered slow.
+
+    Returns
+    -------
+    dict
+        A dictionary representing the updated state of the website.
+    """
+    logger.info(f"Checking website '{web_site.url}'")
+    return web_site.check_website(SlowResponseSeconds=response_limit, PoolManager=http)
+
+
 def publish_changes(changed_sites: list):
     """
     Publish the changed sites to the SQS queue.
@@ -83,22 +453,17 @@ def publish_changes(changed_sites: list):
     -------
         None
     """
-    topic_arn = os.environ['SNS_TOPIC']
-    status_url = os.environ['STATUS_PAGE_URL']
-    topic_name = topic_arn.split(':')[-1]
-
     if len(changed_sites) > 0:
-        logger.info(f"Publishing changes to topic '{topic_name}'")
+        logger.info(f"Publishing changes to topic '{_SNS_TOPIC_NAME}'")
         try:
-            sns = boto3.client('sns')
-            msg = "The following websites are reporting a status change:\n\n"
-            for site in changed_sites:
-                msg += f"{site.url}: status: {site.http_status} - {site.http_reason}\n"
-
-            msg += f"\nYou can view the full website status here: {status_url}"
+            lines = ["The following websites are reporting a status change:\n"]
+            lines.extend(f"{site['url']}: status: {site['http_status']} - {site['http_reason']}"
+                         for site in changed_sites)
+            lines.append(f"\nYou can view the full website status here: {_STATUS_URL}")
+            msg = "\n".join(lines)
 
-            sns.publish(TopicArn=topic_arn, Subject='Notification of Website Status Change', Message=msg)
+            _sns.publish(TopicArn=_SNS_TOPIC, Subject='Notification of Website Status Change', Message=msg)
 
         except Exception as e:
-            logger.error(f"Failed publishing change website notifications to {topic_name}: {str(e)}")
+            logger.error(f"Failed publishing change website notifications to {_SNS_TOPIC_NAME}: {str(e)}")
 